@@ -0,0 +1,148 @@
+"""
+Reports per-client response times in the Dg645 emulator while an IOC, a scripting server
+and a GUI share it, with DLAY writes interleaved between the polls of the other clients.
+Response times are measured by the clients, queueing delays are the time requests spent in
+the emulator's request queue behind requests from other clients.
+
+Run from the system_tests directory:
+
+    python -m benchmarks.dg645_contention [--duration 5] [--asyncio]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from multiprocessing import Event, Pipe, Process
+
+from benchmarks.dg645_stream_latency import REPLY_TERMINATOR, connect, free_port, run_emulator
+
+
+async def ioc(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, until: float
+) -> tuple[int, list[float]]:
+    # Polls every channel's delay back to back, like the asyn driver's scan
+    requests, responses = 0, []
+    while time.perf_counter() < until:
+        for channel in range(10):
+            start = time.perf_counter()
+            writer.write("DLAY?{}\n".format(channel).encode())
+            await writer.drain()
+            await reader.readuntil(REPLY_TERMINATOR)
+            responses.append(time.perf_counter() - start)
+            requests += 1
+    return requests, responses
+
+
+async def script(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, until: float
+) -> tuple[int, list[float]]:
+    # Writes single delays and reads each one back
+    requests, responses = 0, []
+    while time.perf_counter() < until:
+        for channel in range(2, 10):
+            start = time.perf_counter()
+            writer.write("DLAY {},0,{}e-6\nDLAY?{}\n".format(channel, requests, channel).encode())
+            await writer.drain()
+            await reader.readuntil(REPLY_TERMINATOR)
+            responses.append(time.perf_counter() - start)
+            requests += 2
+    return requests, responses
+
+
+async def gui(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, until: float
+) -> tuple[int, list[float]]:
+    # Applies a whole scheme as one locked transaction, then polls it at display rate
+    requests, responses = 0, []
+    while time.perf_counter() < until:
+        start = time.perf_counter()
+        writer.write(b"LOCK?;DLAY 2,0,1e-6;DLAY 3,2,2e-6;DLAY 4,0,3e-6;UNLK?\n")
+        await writer.drain()
+        await reader.readuntil(REPLY_TERMINATOR)
+        await reader.readuntil(REPLY_TERMINATOR)
+        responses.append(time.perf_counter() - start)
+        for channel in range(2, 5):
+            start = time.perf_counter()
+            writer.write("DLAY?{}\n".format(channel).encode())
+            await writer.drain()
+            await reader.readuntil(REPLY_TERMINATOR)
+            responses.append(time.perf_counter() - start)
+        requests += 4
+        await asyncio.sleep(0.01)
+    return requests, responses
+
+
+async def run_clients(port: int, duration: float) -> dict[str, tuple[str, int, list[float]]]:
+    clients = {"ioc": ioc, "script": script, "gui": gui}
+    connections = {name: await connect(port) for name in clients}
+    until = time.perf_counter() + duration
+    try:
+        requests = await asyncio.gather(
+            *(client(*connections[name], until) for name, client in clients.items())
+        )
+    finally:
+        for _, writer in connections.values():
+            writer.close()
+
+    # The emulator knows clients by the address of their end of the connection
+    peers = {
+        name: "{}:{}".format(*writer.get_extra_info("sockname")[:2])
+        for name, (_, writer) in connections.items()
+    }
+    return {
+        name: (peers[name], count, responses) for name, (count, responses) in zip(clients, requests)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5, help="Seconds to run for")
+    parser.add_argument(
+        "--asyncio", action="store_true", help="Serve the emulator with the asyncio transport"
+    )
+    args = parser.parse_args()
+
+    port = free_port()
+    ready, stop = Event(), Event()
+    stats_receiver, stats_sender = Pipe(duplex=False)
+    emulator = Process(
+        target=run_emulator,
+        args=(args.asyncio, port, ready, stop, stats_sender),
+    )
+    emulator.start()
+    try:
+        ready.wait()
+        clients = asyncio.run(run_clients(port, args.duration))
+    finally:
+        stop.set()
+        stats = stats_receiver.recv()
+        emulator.join()
+
+    print(
+        "{:<10}{:>10}{:>14}{:>18}{:>18}{:>18}{:>18}".format(
+            "client",
+            "requests",
+            "requests/s",
+            "mean reply (ms)",
+            "max reply (ms)",
+            "mean queued (ms)",
+            "max queued (ms)",
+        )
+    )
+    for name, (peer, requests, responses) in clients.items():
+        print(
+            "{:<10}{:>10}{:>14.0f}{:>18.3f}{:>18.3f}{:>18.3f}{:>18.3f}".format(
+                name,
+                requests,
+                requests / args.duration,
+                statistics.mean(responses) * 1000,
+                max(responses) * 1000,
+                stats[peer]["mean"] * 1000,
+                stats[peer]["max"] * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Compares connection setup and request latency of the Dg645 emulator served through lewis'
+asyncore based StreamAdapter and with the adapter's asyncio option set.
+
+Run from the system_tests directory:
+
+    python -m benchmarks.dg645_stream_latency [--clients 1 10 100] [--requests 50]
+"""
+
+import argparse
+import asyncio
+import socket
+import statistics
+import time
+from multiprocessing import Event, Process
+from multiprocessing.connection import Connection
+
+from lewis.core.adapters import AdapterCollection
+
+from lewis_emulators.Dg645.device import SimulatedDg645
+from lewis_emulators.Dg645.interfaces import Dg645StreamInterface
+
+HOST = "127.0.0.1"
+REQUEST = b"DLAY?2\n"
+REPLY_TERMINATOR = b"\r\n"
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def run_emulator(
+    use_asyncio: bool,
+    port: int,
+    ready: Event,
+    stop: Event,
+    stats: Connection | None = None,
+) -> None:
+    device = SimulatedDg645()
+    interface = Dg645StreamInterface()
+    interface.device = device
+    adapter = interface.adapter(
+        options={"bind_address": HOST, "port": port, "asyncio": use_asyncio}
+    )
+    adapter.interface = interface
+
+    adapters = AdapterCollection(adapter)
+    adapters.connect()
+    ready.set()
+    stop.wait()
+    adapters.disconnect()
+
+    if stats is not None:
+        stats.send(device.get_queueing_stats())
+
+
+async def connect(port: int) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    # The asyncore server only has a listen backlog of 5, so retry refused connections
+    while True:
+        try:
+            return await asyncio.open_connection(HOST, port)
+        except ConnectionError:
+            await asyncio.sleep(0.01)
+
+
+async def run_client(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, requests: int
+) -> list[float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        writer.write(REQUEST)
+        await writer.drain()
+        await reader.readuntil(REPLY_TERMINATOR)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run_clients(port: int, clients: int, requests: int) -> tuple[float, list[float], float]:
+    # All clients connect at once, as they do when the IOC and its clients start up together
+    start = time.perf_counter()
+    connections = await asyncio.gather(*(connect(port) for _ in range(clients)))
+    connected = time.perf_counter() - start
+    try:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(run_client(reader, writer, requests) for reader, writer in connections)
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        for _, writer in connections:
+            writer.close()
+    return connected, [latency for result in results for latency in result], elapsed
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=50, help="Requests per client")
+    args = parser.parse_args()
+
+    print(
+        "{:<12}{:>8}{:>16}{:>14}{:>14}{:>14}".format(
+            "transport", "clients", "connect (ms)", "median (ms)", "p99 (ms)", "requests/s"
+        )
+    )
+    for use_asyncio in (False, True):
+        for clients in args.clients:
+            # The emulator gets its own process so that it does not share the GIL with the clients
+            port = free_port()
+            ready, stop = Event(), Event()
+            emulator = Process(target=run_emulator, args=(use_asyncio, port, ready, stop))
+            emulator.start()
+            try:
+                ready.wait()
+                connected, latencies, elapsed = asyncio.run(
+                    run_clients(port, clients, args.requests)
+                )
+            finally:
+                stop.set()
+                emulator.join()
+
+            print(
+                "{:<12}{:>8}{:>16.1f}{:>14.3f}{:>14.3f}{:>14.0f}".format(
+                    "asyncio" if use_asyncio else "asyncore",
+                    clients,
+                    connected * 1000,
+                    statistics.median(latencies) * 1000,
+                    percentile(latencies, 0.99) * 1000,
+                    len(latencies) / elapsed,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+from typing import Callable
+
+
+class DeviceClock:
+    """
+    Time as seen by the simulated device.
+
+    By default the clock follows lewis' simulation cycle. A virtual clock ignores the
+    simulation cycle and only moves on when advanced explicitly, so that tests can skip
+    through long timing scenarios instantly and with the same result every time. Either
+    way, the device is processed in steps of at most ``step`` seconds.
+    """
+
+    def __init__(self, virtual: bool = False, step: float = 0.1) -> None:
+        self.virtual = virtual
+        self.step = step
+        self._now = 0.0
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float, process: Callable[[float], None]) -> None:
+        until = self._now + seconds
+        while self._now < until:
+            step_end = min(self._now + self.step, until)
+            dt, self._now = step_end - self._now, step_end
+            process(dt)
@@ -1,8 +1,11 @@
+import copy
+import time
 from collections import OrderedDict
 from typing import Callable
 
 from lewis.devices import StateMachineDevice
 
+from .clock import DeviceClock
 from .states import DefaultState, State
 
 
@@ -21,17 +24,53 @@ class SimulatedDg645(StateMachineDevice):
             (0, 0.0),  # G
             (0, 0.0),  # H
         ]
+        # Validated delay schemes saved by name from the backdoor
+        self.schemes = {}
+        # Delay schemes in the *SAV/*RCL settings locations 0-9, all of them hold the defaults
+        # until saved to, location 0 always does
+        self.settings_locations = {location: tuple(self.delays) for location in range(10)}
         self.trigger_source = 0
         self.level_amplitude = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.level_offset = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.level_polarity = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.trigger_level = 0
         self.error_queue = []
+        self.error_count = 0  # Every error raised, including those that did not fit in the queue
+
+        # Multi-client arbitration. Clients are identified by the name of their connection,
+        # the front panel is a client of its own
+        self.FRONT_PANEL = "front panel"
+        self.lock_owner = None  # Client holding the LOCK? lock, if any
+        self.remote_clients = set()  # Clients that sent REMT and have not gone back with LCAL
+        self.queueing_delays = {}
+
+        # Source of time for the device, swap in a virtual clock to control time from tests
+        self.clock = DeviceClock()
+
+        # Trace of (time, client, request, reply) for every request served while tracing. It is
+        # stamped in wall-clock time by design, even with a virtual clock: it records when the
+        # clients' requests actually arrived, which is what the scan optimiser measures
+        self.tracing = False
+        self.command_trace = []
+
+        # Everything a command line may change, restored if any command in the line fails
+        self.SETTINGS = (
+            "delays",
+            "trigger_source",
+            "level_amplitude",
+            "level_offset",
+            "level_polarity",
+            "trigger_level",
+            "lock_owner",
+            "remote_clients",
+        )
 
         # Error codes
         self.NO_ERROR_IN_QUEUE_CODE = 0
         self.ILLEGAL_VALUE_ERROR_CODE = 10
         self.ILLEGAL_LINK_ERROR_CODE = 13
+        self.NOT_ALLOWED_ERROR_CODE = 15
+        self.ILLEGAL_COMMAND_ERROR_CODE = 110
 
     def _get_state_handlers(self) -> dict[str, State]:
         return {
@@ -44,6 +83,24 @@ class SimulatedDg645(StateMachineDevice):
     def _get_transition_handlers(self) -> dict[tuple[str, str], Callable[[], bool]]:
         return OrderedDict([])
 
+    def process(self, dt: float = 0) -> None:
+        # A virtual clock ignores lewis' simulation cycle and only moves on in advance_time
+        if not self.clock.virtual:
+            self.clock.advance(dt, super().process)
+
+    def advance_time(self, seconds: float) -> None:
+        self.clock.advance(float(seconds), super().process)
+
+    def use_virtual_clock(self) -> None:
+        self.clock.virtual = True
+
+    def use_wall_clock(self) -> None:
+        self.clock.virtual = False
+
+    @property
+    def clock_time(self) -> float:
+        return self.clock.time()
+
     def update_trigger_delays(self) -> None:
         # T0 is the base - always 0
         # T1 is always the longest delay
@@ -53,6 +110,81 @@ class SimulatedDg645(StateMachineDevice):
                 t1_delay = delay[1]
         self.delays[1] = (0, t1_delay)
 
+    def links_valid(self, delays: list[tuple[int, float]]) -> bool:
+        # T0 and T1 can not be linked, T1 can not be referenced and links must not form a loop
+        if delays[0][0] != 0 or delays[1][0] != 0:
+            return False
+        for channel in range(2, len(delays)):
+            seen = {channel}
+            target = delays[channel][0]
+            while target != 0:
+                if target == 1 or target in seen or not 0 <= target < len(delays):
+                    return False
+                seen.add(target)
+                target = delays[target][0]
+        return True
+
+    def apply_delays(self, changes: dict[int, tuple[int, object]]) -> bool:
+        # Validates the link graph with every change in place, then applies all of them or none
+        delays = list(self.delays)
+        for which, (target, amount) in changes.items():
+            if not 0 <= which < len(delays):
+                self.add_error(self.ILLEGAL_VALUE_ERROR_CODE)
+                return False
+            if which in (0, 1):
+                # T0 and T1 follow from the other channels and can not be set
+                self.add_error(self.ILLEGAL_LINK_ERROR_CODE)
+                return False
+            try:
+                # If the delay is set on the device to a precision of 10e-12 then
+                # last digit is rounded to 5 or 0
+                delays[which] = (int(target), self.round_value_pcs(amount))
+            except (TypeError, ValueError):
+                self.add_error(self.ILLEGAL_VALUE_ERROR_CODE)
+                return False
+        if not self.links_valid(delays):
+            self.add_error(self.ILLEGAL_LINK_ERROR_CODE)
+            return False
+        self.delays = delays
+        self.update_trigger_delays()
+        return True
+
+    def apply_scheme(self, scheme: list[tuple[int, float]], name: object = None) -> bool:
+        # A scheme sets channels A to H, T0 and T1 follow from it
+        if len(scheme) != len(self.delays) - 2:
+            self.add_error(self.ILLEGAL_VALUE_ERROR_CODE)
+            return False
+        applied = self.apply_delays(dict(enumerate(scheme, start=2)))
+        if applied and name is not None:
+            self.save_scheme(name)
+        return applied
+
+    def save_scheme(self, name: object) -> None:
+        self.schemes[name] = tuple(self.delays)
+
+    def load_scheme(self, name: object) -> bool:
+        # Saved schemes were validated when they were applied, so they are loaded as they are
+        if name not in self.schemes:
+            self.add_error(self.ILLEGAL_VALUE_ERROR_CODE)
+            return False
+        self.delays = list(self.schemes[name])
+        return True
+
+    def save_settings_location(self, location: int) -> bool:
+        # Location 0 holds the factory defaults and can only be recalled
+        if not 1 <= location <= 9:
+            self.add_error(self.ILLEGAL_VALUE_ERROR_CODE)
+            return False
+        self.settings_locations[location] = tuple(self.delays)
+        return True
+
+    def recall_settings_location(self, location: int) -> bool:
+        if location not in self.settings_locations:
+            self.add_error(self.ILLEGAL_VALUE_ERROR_CODE)
+            return False
+        self.delays = list(self.settings_locations[location])
+        return True
+
     def get_error(self) -> int:
         if len(self.error_queue) > 0:
             return self.error_queue.pop(0)
@@ -60,10 +192,89 @@ class SimulatedDg645(StateMachineDevice):
             return self.NO_ERROR_IN_QUEUE_CODE
 
     def add_error(self, err: int) -> None:
+        self.error_count += 1
         self.error_queue.append(err)
         # Device holds a queue of errors of size 20
         self.error_queue = self.error_queue[:20]
 
+    def save_settings(self) -> dict[str, object]:
+        return {name: copy.deepcopy(getattr(self, name)) for name in self.SETTINGS}
+
+    def restore_settings(self, settings: dict[str, object]) -> None:
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def go_remote(self, client: str) -> None:
+        self.remote_clients.add(client)
+
+    def go_local(self, client: str) -> None:
+        self.remote_clients.discard(client)
+
+    @property
+    def front_panel_enabled(self) -> bool:
+        # The key pad stays disabled while any connection is in remote mode
+        return not self.remote_clients
+
+    def request_lock(self, client: str) -> int:
+        if self.lock_owner is None or self.lock_owner == client:
+            self.lock_owner = client
+            return 1
+        return 0
+
+    def release_lock(self, client: str) -> int:
+        if self.lock_owner is not None and self.lock_owner == client:
+            self.lock_owner = None
+            return 1
+        return 0
+
+    def write_allowed(self, client: str) -> bool:
+        # Settings may only be altered by the lock owner, and not from the front panel in remote
+        locked_out = self.lock_owner is not None and self.lock_owner != client
+        if locked_out or (client == self.FRONT_PANEL and not self.front_panel_enabled):
+            self.add_error(self.NOT_ALLOWED_ERROR_CODE)
+            return False
+        return True
+
+    def client_disconnected(self, client: str) -> None:
+        # A connection that goes away must not leave the device locked or in remote
+        self.release_lock(client)
+        self.go_local(client)
+
+    def record_queueing_delay(self, client: str, delay: float) -> None:
+        stats = self.queueing_delays.setdefault(client, {"requests": 0, "total": 0.0, "max": 0.0})
+        stats["requests"] += 1
+        stats["total"] += delay
+        stats["max"] = max(stats["max"], delay)
+
+    def get_queueing_stats(self) -> dict[str, dict[str, float]]:
+        return {
+            client: {
+                "requests": stats["requests"],
+                "mean": stats["total"] / stats["requests"],
+                "max": stats["max"],
+            }
+            for client, stats in self.queueing_delays.items()
+        }
+
+    def reset_queueing_stats(self) -> None:
+        self.queueing_delays = {}
+
+    def start_command_trace(self) -> None:
+        self.command_trace = []
+        self.tracing = True
+
+    def stop_command_trace(self) -> None:
+        self.tracing = False
+
+    def record_command(self, client: str, request: str, reply: object) -> None:
+        if self.tracing:
+            reply = None if reply is None else str(reply)
+            # Not self.clock, see _initialize_data
+            self.command_trace.append((time.monotonic(), client, request, reply))
+
+    def get_command_trace(self) -> list[tuple[float, str, str, str | None]]:
+        return self.command_trace
+
     # Rounds up numbers of precision of 10e-12 and lower to 5 or 0
     def round_value_pcs(self, value: float) -> float:
         new_value = "{:.12f}".format(float(value))
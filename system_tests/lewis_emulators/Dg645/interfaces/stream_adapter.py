@@ -0,0 +1,304 @@
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING
+
+from lewis.adapters.stream import StreamAdapter, StreamHandler, StreamServer
+from lewis.core.logging import has_log
+
+if TYPE_CHECKING:
+    from lewis_emulators.Dg645.interfaces.stream_interface import Dg645StreamInterface
+
+
+class RequestDispatcher:
+    # Same dispatch as lewis' StreamHandler, shared by the handlers of both transports
+    def _dispatch(self, request: bytes) -> str | None:
+        try:
+            cmd = next(
+                (cmd for cmd in self._target.bound_commands if cmd.can_process(request)),
+                None,
+            )
+
+            if cmd is None:
+                raise RuntimeError("None of the device's commands matched.")
+
+            self.log.info("Processing request %s using command %s", request, cmd.matcher.pattern)
+
+            return cmd.process_request(request)
+        except Exception as error:
+            return self._handle_error(request, error)
+
+    def serve(self, request: bytes, queued: float) -> str | None:
+        # Point the interface at this connection so that it knows who is asking
+        self._target.handler = self
+        self._target.record_queueing_delay(self.peer, queued)
+        reply = self._dispatch(request)
+        self._target.record_command(self.peer, request.decode(errors="replace"), reply)
+        return reply
+
+
+class RequestQueue:
+    """
+    Requests from all clients of the device in the order they were read. Each request is
+    stamped when it is read, so the time it spends behind requests from other clients and
+    waiting for the device lock is reported as its queueing delay.
+    """
+
+    def __init__(self, device_lock: threading.Lock) -> None:
+        self._device_lock = device_lock
+        self._requests: deque[tuple[float, RequestDispatcher, bytes]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def put(self, handler: RequestDispatcher, request: bytes) -> None:
+        self._requests.append((time.monotonic(), handler, request))
+
+    def serve(self) -> None:
+        # Everything queued so far is served under a single acquisition of the device lock,
+        # and each client's replies go out in a single write
+        replies: dict[RequestDispatcher, list[str | None]] = {}
+        with self._device_lock:
+            while self._requests:
+                arrived, handler, request = self._requests.popleft()
+                reply = handler.serve(request, time.monotonic() - arrived)
+                replies.setdefault(handler, []).append(reply)
+        for handler, handler_replies in replies.items():
+            handler.send_replies(handler_replies)
+
+
+@has_log
+class Dg645StreamHandler(RequestDispatcher, StreamHandler):
+    def __init__(
+        self,
+        sock: socket.socket,
+        target: "Dg645StreamInterface",
+        stream_server: "Dg645StreamServer",
+    ) -> None:
+        super().__init__(sock, target, stream_server)
+        self.peer = "{}:{}".format(*sock.getpeername()[:2])
+
+    def found_terminator(self) -> None:
+        # Served by the adapter once asyncore has read from every client that is ready
+        self._readtimer = 0
+        self._stream_server.requests.put(self, self._get_request())
+
+    def send_replies(self, replies: list[str | None]) -> None:
+        data = b"".join(
+            str(reply).encode() + self._target.out_terminator.encode()
+            for reply in replies
+            if reply is not None
+        )
+        if data and self.connected:
+            self.log.debug("Sending reply %s", data)
+            self.push(data)
+
+    def handle_close(self) -> None:
+        with self._stream_server.device_lock:
+            self._target.client_disconnected(self.peer)
+            if getattr(self._target, "handler", None) is self:
+                del self._target.handler
+        super().handle_close()
+
+
+@has_log
+class Dg645StreamServer(StreamServer):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        target: "Dg645StreamInterface",
+        device_lock: threading.Lock,
+        requests: RequestQueue,
+    ) -> None:
+        super().__init__(host, port, target, device_lock)
+        self.requests = requests
+
+    def handle_accept(self) -> None:
+        pair = self.accept()
+        if pair is not None:
+            sock, _ = pair
+            self._accepted_connections.append(Dg645StreamHandler(sock, self.target, self))
+
+
+@has_log
+class AsyncioStreamHandler(RequestDispatcher, asyncio.BufferedProtocol):
+    def __init__(self, target: "Dg645StreamInterface", adapter: "Dg645StreamAdapter") -> None:
+        self._target = target
+        self._adapter = adapter
+        self._in_terminator = target.in_terminator.encode()
+        self._out_terminator = target.out_terminator.encode()
+        self._transport: asyncio.Transport | None = None
+        self.peer = None
+        self._buffer = b""
+        # Reads go into one small reusable buffer, a plain Protocol allocates 256 KiB per read
+        self._read_buffer = bytearray(4096)
+        self._readtimer: asyncio.TimerHandle | None = None
+
+        self._set_logging_context(target)
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+        self.peer = "{}:{}".format(*transport.get_extra_info("peername")[:2])
+        self._target.handler = self
+        self._adapter.add_handler(self)
+        self.log.info("Client connected from %s", self.peer)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.log.info("Closing connection to client %s", self.peer)
+        self._cancel_readtimer()
+        self._transport = None
+        with self._adapter.device_lock:
+            self._target.client_disconnected(self.peer)
+            if getattr(self._target, "handler", None) is self:
+                del self._target.handler
+        self._adapter.remove_handler(self)
+
+    def get_buffer(self, sizehint: int) -> bytearray:
+        return self._read_buffer
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._cancel_readtimer()
+        self._buffer += self._read_buffer[:nbytes]
+
+        while self._in_terminator and self._in_terminator in self._buffer:
+            request, self._buffer = self._buffer.split(self._in_terminator, 1)
+            self._adapter.put_request(self, request)
+
+        # Same semantics as lewis: the read timeout only runs once a request has started
+        if self._buffer and self._target.readtimeout != 0:
+            self._readtimer = self._adapter.loop.call_later(
+                self._target.readtimeout / 1000, self._read_timed_out
+            )
+
+    def _read_timed_out(self) -> None:
+        self._readtimer = None
+        request, self._buffer = self._buffer, b""
+        if self._in_terminator:
+            error = RuntimeError("ReadTimeout while waiting for command terminator.")
+            with self._adapter.device_lock:
+                reply = self._handle_error(request, error)
+            self.send_replies([reply])
+        else:
+            # If no terminator is set, the timeout is the terminator
+            self._adapter.put_request(self, request)
+
+    def _cancel_readtimer(self) -> None:
+        if self._readtimer is not None:
+            self._readtimer.cancel()
+            self._readtimer = None
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._transport is not None
+
+    def _handle_error(self, request: bytes, error: Exception) -> str | None:
+        self.log.debug("Error while processing request", exc_info=error)
+        return self._target.handle_error(request, error)
+
+    def send_replies(self, replies: list[str | None]) -> None:
+        data = b"".join(
+            str(reply).encode() + self._out_terminator for reply in replies if reply is not None
+        )
+        if data and self.connected:
+            self.log.debug("Sending reply %s", data)
+            self._transport.write(data)
+
+    def unsolicited_reply(self, reply: str) -> None:
+        # May be called from the simulation thread, so hand the write over to the event loop
+        self.log.debug("Sending unsolicited reply %s", reply)
+        self._adapter.loop.call_soon_threadsafe(self.send_replies, [reply])
+
+
+class Dg645StreamAdapter(StreamAdapter):
+    """
+    Lewis' StreamAdapter with the option to serve the interface from an asyncio event loop
+    instead of asyncore, select it with ``-p "stream: {asyncio: true}"``. Requests are
+    dispatched as soon as their terminator arrives and the listen backlog is 128 instead
+    of 5, so that many clients can connect at once. With either transport, requests from
+    all clients go through one queue and the interface knows which connection each request
+    came from.
+    """
+
+    default_options = dict(StreamAdapter.default_options, asyncio=False)
+
+    def __init__(self, options: dict | None = None) -> None:
+        super().__init__(options)
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._handlers: list[AsyncioStreamHandler] = []
+        self.requests: RequestQueue | None = None
+
+    def start_server(self) -> None:
+        if self._server is not None:
+            return
+
+        if self._options.telnet_mode:
+            self.interface.in_terminator = "\r\n"
+            self.interface.out_terminator = "\r\n"
+
+        # The adapter collection only hands the device lock over after construction
+        self.requests = RequestQueue(self.device_lock)
+        if not self._options.asyncio:
+            self._server = Dg645StreamServer(
+                self._options.bind_address,
+                self._options.port,
+                self.interface,
+                self.device_lock,
+                self.requests,
+            )
+        else:
+            self.loop = asyncio.new_event_loop()
+            self._server = self.loop.run_until_complete(
+                self.loop.create_server(
+                    lambda: AsyncioStreamHandler(self.interface, self),
+                    self._options.bind_address,
+                    self._options.port,
+                    reuse_address=True,
+                    backlog=128,
+                )
+            )
+            self.log.info("Listening on %s:%s", self._options.bind_address, self._options.port)
+
+    def stop_server(self) -> None:
+        if not self._options.asyncio:
+            super().stop_server()
+        elif self._server is not None:
+            self.log.info("Shutting down server, closing all remaining client connections.")
+            self._server.close()
+            for handler in list(self._handlers):
+                handler.close()
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.close()
+
+            self._handlers = []
+            self._server = None
+            self.loop = None
+
+    def add_handler(self, handler: AsyncioStreamHandler) -> None:
+        self._handlers.append(handler)
+
+    def remove_handler(self, handler: AsyncioStreamHandler) -> None:
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    def put_request(self, handler: AsyncioStreamHandler, request: bytes) -> None:
+        # Requests read in the same pass of the event loop, from any client, are queued
+        # before the queue is served
+        if not self.requests:
+            self.loop.call_soon(self.requests.serve)
+        self.requests.put(handler, request)
+
+    def handle(self, cycle_delay: float = 0.1) -> None:
+        if not self._options.asyncio:
+            super().handle(cycle_delay)
+            self.requests.serve()
+        else:
+            # Requests are handled by the event loop as they arrive, the cycle delay only
+            # controls how often control is handed back to lewis' adapter thread
+            self.loop.run_until_complete(asyncio.sleep(cycle_delay))
@@ -3,12 +3,15 @@ from lewis.core.logging import has_log
 from lewis.utils.command_builder import CmdBuilder
 
 from lewis_emulators.Dg645.device import SimulatedDg645
+from lewis_emulators.Dg645.interfaces.stream_adapter import Dg645StreamAdapter
 
 
 @has_log
 class Dg645StreamInterface(StreamInterface):
     def __init__(self) -> None:
         self._device: SimulatedDg645
+        # DLAY settings collected from one command line, applied together
+        self._delay_batch: dict[int, tuple[int, str]] | None = None
 
     commands = {
         CmdBuilder("get_ident").escape("*IDN?").eos().build(),
@@ -22,7 +25,7 @@ class Dg645StreamInterface(StreamInterface):
         .int()
         .optional(",")
         .spaces()
-        .any()
+        .any_except(";")
         .eos()
         .build(),
         CmdBuilder("get_trigger_source").escape("TSRC?").eos().build(),
@@ -35,7 +38,7 @@ class Dg645StreamInterface(StreamInterface):
         .int()
         .optional(",")
         .spaces()
-        .any()
+        .any_except(";")
         .eos()
         .build(),
         CmdBuilder("get_level_offset").escape("LOFF?").spaces().int().eos().build(),
@@ -46,7 +49,7 @@ class Dg645StreamInterface(StreamInterface):
         .int()
         .optional(",")
         .spaces()
-        .any()
+        .any_except(";")
         .eos()
         .build(),
         CmdBuilder("get_level_polarity").escape("LPOL?").spaces().int().eos().build(),
@@ -56,7 +59,7 @@ class Dg645StreamInterface(StreamInterface):
         .int()
         .optional(",")
         .spaces()
-        .any()
+        .any_except(";")
         .eos()
         .build(),
         CmdBuilder("get_last_error").escape("LERR?").eos().build(),
@@ -65,6 +68,10 @@ class Dg645StreamInterface(StreamInterface):
         CmdBuilder("set_trigger_level").escape("TLVL").spaces().float().eos().build(),
         CmdBuilder("local_mode").escape("LCAL").eos().build(),
         CmdBuilder("remote_mode").escape("REMT").eos().build(),
+        CmdBuilder("request_lock").escape("LOCK?").eos().build(),
+        CmdBuilder("release_lock").escape("UNLK?").eos().build(),
+        # Several commands may be sent on one line, separated by semicolons
+        CmdBuilder("multi_command").get_multicommands(";").eos().build(),
         CmdBuilder("save_config").escape("*SAV").spaces().int().eos().build(),
         CmdBuilder("load_config").escape("*RCL").spaces().int().eos().build(),
         # Commands below are only defined but not implemented because without it, the Delaygen
@@ -88,6 +95,10 @@ class Dg645StreamInterface(StreamInterface):
     in_terminator = "\n"
     out_terminator = "\r\n"
 
+    @property
+    def adapter(self) -> type[Dg645StreamAdapter]:
+        return Dg645StreamAdapter
+
     # Trigger source can be selected from 6 enum values
     # which are represented by numbers 0-5
     def check_trigger_source_valid(self, new_trg_src: int) -> bool:
@@ -98,6 +109,62 @@ class Dg645StreamInterface(StreamInterface):
     def catch_all(self, command: str) -> None:
         pass
 
+    def _client(self) -> str:
+        # Both transports of Dg645StreamAdapter point handler at the connection being served
+        # before dispatching, the fallback only applies to calls made outside of a request
+        return getattr(getattr(self, "handler", None), "peer", "stream")
+
+    def multi_command(self, first: str, rest: str) -> str | None:
+        # The whole line is served in one go from the adapter's request queue, so the
+        # commands in it are applied without requests from other clients in between.
+        # Consecutive DLAY settings are batched and validated and applied as one scheme.
+        # If any command fails the settings are restored and the error is left in the error
+        # queue, the queries in the line are still answered so that the client is not left
+        # waiting for their replies
+        settings = self._device.save_settings()
+        error_count = self._device.error_count
+        replies = []
+        for command in [first] + rest.split(";"):
+            request = command.strip().encode()
+            if not request:
+                continue
+            cmd = next((cmd for cmd in self.bound_commands if cmd.can_process(request)), None)
+            if cmd is not None and cmd.func == self.set_delay:
+                if self._delay_batch is None:
+                    self._delay_batch = {}
+            else:
+                self._apply_delay_batch()
+            if cmd is None:
+                self.log.debug("None of the device's commands matched %s", request)
+                self._device.add_error(self._device.ILLEGAL_COMMAND_ERROR_CODE)
+                continue
+            try:
+                reply = cmd.process_request(request)
+            except Exception as error:
+                self.log.debug("Error while processing %s", request, exc_info=error)
+                self._device.add_error(self._device.ILLEGAL_VALUE_ERROR_CODE)
+                continue
+            if reply is not None:
+                replies.append(str(reply))
+        self._apply_delay_batch()
+        if self._device.error_count != error_count:
+            self._device.restore_settings(settings)
+        return self.out_terminator.join(replies) if replies else None
+
+    def _apply_delay_batch(self) -> None:
+        batch, self._delay_batch = self._delay_batch, None
+        if batch and self._device.write_allowed(self._client()):
+            self._device.apply_delays(batch)
+
+    def record_queueing_delay(self, client: str, delay: float) -> None:
+        self._device.record_queueing_delay(client, delay)
+
+    def record_command(self, client: str, request: str, reply: object) -> None:
+        self._device.record_command(client, request, reply)
+
+    def client_disconnected(self, client: str) -> None:
+        self._device.client_disconnected(client)
+
     def get_ident(self) -> str:
         return self._device.identification
 
@@ -109,19 +176,20 @@ class Dg645StreamInterface(StreamInterface):
             + str("{:.12f}".format(float(self._device.delays[which][1])))
         )
 
-    def set_delay(self, which: int, target: int, amount: float) -> None:
-        if which == target or which == 0 or which == 1 or target == 1:
-            self._device.add_error(self._device.ILLEGAL_LINK_ERROR_CODE)
+    def set_delay(self, which: int, target: int, amount: str) -> None:
+        if self._delay_batch is not None:
+            self._delay_batch[which] = (target, amount)
             return
-        # If the delay is set on the device to a precision of 10e-12 then
-        # last digit is rounded to 5 or 0
-        self._device.delays[which] = (target, self._device.round_value_pcs(amount))
-        self._device.update_trigger_delays()
+        if not self._device.write_allowed(self._client()):
+            return
+        self._device.apply_delays({which: (target, amount)})
 
     def get_trigger_source(self) -> int:
         return self._device.trigger_source
 
     def set_trigger_source(self, new: int) -> None:
+        if not self._device.write_allowed(self._client()):
+            return
         if not self.check_trigger_source_valid(new):
             self._device.add_error(self._device.ILLEGAL_VALUE_ERROR_CODE)
         self._device.trigger_source = new
@@ -130,18 +198,24 @@ class Dg645StreamInterface(StreamInterface):
         return self._device.level_amplitude[which]
 
     def set_level_amplitude(self, which: int, new: int) -> None:
+        if not self._device.write_allowed(self._client()):
+            return
         self._device.level_amplitude[which] = new
 
     def get_level_offset(self, which: int) -> int:
         return self._device.level_offset[which]
 
     def set_level_offset(self, which: int, new: int) -> None:
+        if not self._device.write_allowed(self._client()):
+            return
         self._device.level_offset[which] = new
 
     def get_level_polarity(self, which: int) -> int:
         return self._device.level_polarity[which]
 
     def set_level_polarity(self, which: int, new: int) -> None:
+        if not self._device.write_allowed(self._client()):
+            return
         self._device.level_polarity[which] = new
 
     def get_last_error(self) -> int:
@@ -154,19 +228,30 @@ class Dg645StreamInterface(StreamInterface):
         return self._device.trigger_level
 
     def set_trigger_level(self, new: int) -> None:
+        if not self._device.write_allowed(self._client()):
+            return
         self._device.trigger_level = new
 
     def local_mode(self) -> None:
-        return
+        self._device.go_local(self._client())
 
     def remote_mode(self) -> None:
-        return
+        self._device.go_remote(self._client())
 
+    def request_lock(self) -> int:
+        return self._device.request_lock(self._client())
+
+    def release_lock(self) -> int:
+        return self._device.release_lock(self._client())
+
+    # Only the delay scheme is stored in and recalled from a settings location
     def load_config(self, id: int) -> None:
-        return
+        if not self._device.write_allowed(self._client()):
+            return
+        self._device.recall_settings_location(id)
 
     def save_config(self, id: int) -> None:
-        return
+        self._device.save_settings_location(id)
 
     # End of currently tested commands
     # Commands below only return default value to pass Delaygen's
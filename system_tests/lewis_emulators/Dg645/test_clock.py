@@ -0,0 +1,59 @@
+import unittest
+
+from lewis_emulators.Dg645.clock import DeviceClock
+from lewis_emulators.Dg645.device import SimulatedDg645
+
+
+class DeviceClockTests(unittest.TestCase):
+    def test_WHEN_advanced_THEN_processed_in_steps_up_to_step_size(self):
+        clock = DeviceClock(step=0.1)
+        steps = []
+
+        clock.advance(0.35, steps.append)
+
+        self.assertEqual(len(steps), 4)
+        for step in steps[:3]:
+            self.assertAlmostEqual(step, 0.1)
+        self.assertAlmostEqual(steps[3], 0.05)
+        self.assertAlmostEqual(sum(steps), 0.35)
+
+    def test_WHEN_advanced_many_steps_THEN_ends_exactly_at_requested_time(self):
+        clock = DeviceClock(step=0.1)
+
+        clock.advance(3600, lambda dt: None)
+        clock.advance(0.25, lambda dt: None)
+
+        self.assertEqual(clock.time(), 3600.25)
+
+    def test_WHEN_advanced_by_nothing_THEN_not_processed(self):
+        clock = DeviceClock()
+        steps = []
+
+        clock.advance(0, steps.append)
+
+        self.assertEqual(steps, [])
+        self.assertEqual(clock.time(), 0)
+
+
+class SimulatedDg645ClockTests(unittest.TestCase):
+    def setUp(self):
+        self.device = SimulatedDg645()
+
+    def test_WHEN_wall_clock_used_THEN_device_time_follows_simulation_cycle(self):
+        self.device.process(0.5)
+        self.device.process(0.25)
+
+        self.assertEqual(self.device.clock_time, 0.75)
+
+    def test_WHEN_virtual_clock_used_THEN_device_time_only_moves_when_advanced(self):
+        self.device.use_virtual_clock()
+
+        self.device.process(0.5)
+        self.assertEqual(self.device.clock_time, 0)
+
+        self.device.advance_time(3600)
+        self.assertEqual(self.device.clock_time, 3600)
+
+        self.device.use_wall_clock()
+        self.device.process(0.5)
+        self.assertEqual(self.device.clock_time, 3600.5)
@@ -7,6 +7,13 @@ call "%~dp0..\..\..\..\config_env.bat"
 
 set "PYTHONUNBUFFERED=1"
 
+REM Unit tests of the tools and emulators in this directory, they need no IOC
+pushd "%~dp0"
+call %PYTHON3% -m unittest discover --pattern "test_*.py"
+SET UnitTestsError=%ERRORLEVEL%
+popd
+IF %UnitTestsError% NEQ 0 EXIT /b %UnitTestsError%
+
 REM Command line arguments always passed to the test script
 SET ARGS=--test_and_emulator %~dp0
 call %PYTHON3% "%EPICS_KIT_ROOT%\support\IocTestFramework\master\run_tests.py" %ARGS% %*
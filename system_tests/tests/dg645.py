@@ -1,4 +1,5 @@
 # pyright: reportMissingImports=false
+import ast
 import unittest
 
 from parameterized import parameterized
@@ -57,6 +58,40 @@ class Dg645Tests(unittest.TestCase):
             test_data, "TriggerLevelAI", "TriggerLevelAO", timeout=30
         )
 
+    def test_WHEN_remote_mode_set_THEN_front_panel_disabled(self):
+        self.ca.set_pv_value("MODE:SP", "REMOTE")
+        try:
+            self._lewis.assert_that_emulator_value_is("front_panel_enabled", "False")
+        finally:
+            self.ca.set_pv_value("MODE:SP", "LOCAL")
+        self._lewis.assert_that_emulator_value_is("front_panel_enabled", "True")
+
+    def test_WHEN_another_client_holds_lock_THEN_ioc_write_rejected_as_not_allowed(self):
+        self.ca.assert_setting_setpoint_sets_readback(
+            0.5, "TriggerLevelAI", "TriggerLevelAO", timeout=30
+        )
+        self._lewis.backdoor_run_function_on_device("request_lock", ["script"])
+        try:
+            self.ca.set_pv_value("TriggerLevelAO", 1.25)
+            self.ca.assert_that_pv_value_causes_func_to_return_true(
+                "ERQ9", lambda error: "not allowed" in error.lower()
+            )
+            self.ca.assert_that_pv_is("TriggerLevelAI", 0.5)
+        finally:
+            self._lewis.backdoor_run_function_on_device("release_lock", ["script"])
+        self._lewis.assert_that_emulator_value_is("lock_owner", "None")
+
+    def test_WHEN_virtual_clock_used_THEN_device_time_only_moves_when_advanced(self):
+        self._lewis.backdoor_run_function_on_device("use_virtual_clock")
+        try:
+            start = self._lewis.backdoor_get_from_device("clock_time")
+            # Lewis keeps running its simulation cycle meanwhile, any of its cycles counted
+            # by the device would show up on top of the hour
+            self._lewis.backdoor_run_function_on_device("advance_time", [3600])
+            self._lewis.assert_that_emulator_value_is("clock_time", str(float(start) + 3600))
+        finally:
+            self._lewis.backdoor_run_function_on_device("use_wall_clock")
+
     # OutputAmpAI and OutputOffsetAI values control which logic flag is currently applied, as demonstrated by VI
     # 4, 0 = TTL
     # 0.8, -0.8 = NIM
@@ -134,6 +169,26 @@ class Dg645Tests(unittest.TestCase):
             "Incorrect read back: " + str(value_left) + " != " + str(value_right),
         )
 
+    def check_device_delays(self, channel_settings):
+        # Changes made through the backdoor are not read back by the IOC, so they are checked
+        # on the emulator. channel_settings maps channels to (ref, dlay, unit)
+        expected = {
+            DEVICE_CHANNELS.index(chan): (
+                DEVICE_CHANNELS.index(ref),
+                self.calculate_delay(dlay, unit),
+            )
+            for chan, (ref, dlay, unit) in channel_settings.items()
+        }
+
+        def delays_match(delays):
+            delays = ast.literal_eval(delays)
+            return all(
+                (int(delays[which][0]), round(float(delays[which][1]), 12)) == setting
+                for which, setting in expected.items()
+            )
+
+        self._lewis.assert_that_emulator_value_causes_func_to_return_true("delays", delays_match)
+
     # Returns max delay of all channels set
     def set_all_channels(self, dataset):
         channels_to_set = DEVICE_CHANNELS[2:]
@@ -214,6 +269,48 @@ class Dg645Tests(unittest.TestCase):
             + str(t0_delay_rb + t1_delay_rb),
         )
 
+    def test_WHEN_named_scheme_reloaded_THEN_all_channels_readback_correct(self):
+        channel_settings = (
+            ("T0", 1, "us"),
+            ("A", 31, "us"),
+            ("T0", 22, "ms"),
+            ("C", 12.3, "us"),
+            ("T0", 1.1111, "s"),
+            ("T0", 4324155, "ps"),
+            ("T0", 4, "us"),
+            ("T0", 12, "us"),
+        )
+        scheme = [
+            (DEVICE_CHANNELS.index(ref), self.calculate_delay(dlay, unit))
+            for ref, dlay, unit in channel_settings
+        ]
+        self._lewis.backdoor_run_function_on_device("apply_scheme", [scheme, "test"])
+        self.set_channel_delay("A", "T0", 5, "us", True)
+
+        self._lewis.backdoor_run_function_on_device("load_scheme", ["test"])
+        self.check_device_delays(dict(zip(DEVICE_CHANNELS[2:], channel_settings)))
+
+    def test_WHEN_looping_scheme_applied_THEN_no_channel_changed_and_error_queue_entry_added(self):
+        self.set_channel_delay("A", "T0", 1, "us", True)
+        self.set_channel_delay("B", "T0", 2, "us", True)
+        self.set_channel_delay("C", "T0", 3, "us", True)
+        self._lewis.backdoor_set_on_device("error_queue", [])
+
+        # C is valid on its own, but A and B reference each other
+        scheme = [(3, 3e-6), (2, 4e-6), (0, 5e-6)] + [(0, 0.0)] * 5
+        self._lewis.backdoor_run_function_on_device("apply_scheme", [scheme])
+
+        self._lewis.assert_that_emulator_value_is("error_queue", str([13]))
+        self.check_device_delays({"A": ("T0", 1, "us"), "B": ("T0", 2, "us"), "C": ("T0", 3, "us")})
+
+    def test_WHEN_T0_delay_set_THEN_T0_delay_unchanged_and_error_queue_entry_added(self):
+        self.ca.set_pv_value("T0DelayAO", 1e-6)
+
+        self.ca.assert_that_pv_value_causes_func_to_return_true(
+            "ERQ9", lambda error: "illegal link" in error.lower()
+        )
+        self.check_device_delays({"T0": ("T0", 0, "s")})
+
     # performs a depth-limited recursive search to get final width of a channel
     def get_channel_width(self, channel_data, which, width=0, depth=0):
         delays_dict = {
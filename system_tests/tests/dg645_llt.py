@@ -1,4 +1,5 @@
 # pyright: reportMissingImports=false
+import ast
 import unittest
 
 from parameterized import parameterized
@@ -95,3 +96,28 @@ class Dg645LLTTests(unittest.TestCase):
         self.ca.set_pv_value("MODE", "2")
         self.ca.set_pv_value("SET.PROC", "1")
         self.ca.assert_that_pv_is("ERROR", err)
+
+    def channels_a_to_h(self, delays):
+        # (reference, delay) of channels A to H as read from the emulator
+        return [(int(ref), round(float(delay), 12)) for ref, delay in ast.literal_eval(delays)][2:]
+
+    def test_WHEN_mode_set_THEN_saved_settings_recalled_without_error(self):
+        # A and C as saved by the user into the settings location of mode 1, *RCL 1 is sent
+        # when the mode is set
+        scheme = [(0, 1e-05), (0, 0.0), (0, 2e-05)] + [(0, 0.0)] * 5
+        self._lewis.backdoor_run_function_on_device("apply_scheme", [scheme])
+        self._lewis.backdoor_run_function_on_device("save_settings_location", [1])
+        try:
+            self._lewis.backdoor_run_function_on_device("apply_scheme", [[(0, 0.0)] * 8])
+            self._lewis.backdoor_set_on_device("error_queue", [])
+
+            self.ca.set_pv_value("MODE", "1")
+            self.ca.assert_that_pv_is("SET_MODE", 1)
+
+            self._lewis.assert_that_emulator_value_causes_func_to_return_true(
+                "delays", lambda delays: self.channels_a_to_h(delays) == scheme
+            )
+            self._lewis.assert_that_emulator_value_is("error_queue", str([]))
+        finally:
+            self._lewis.backdoor_run_function_on_device("apply_scheme", [[(0, 0.0)] * 8])
+            self._lewis.backdoor_run_function_on_device("save_settings_location", [1])
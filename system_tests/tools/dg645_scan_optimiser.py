@@ -0,0 +1,499 @@
+"""
+Suggests a minimal polling layout for the dg645Sup databases.
+
+Combines the record graph of dg645Sup/*.db (periodic scans, forward links, PP and CP links)
+with a command trace captured from the Dg645 emulator. Reports device reads which returned
+a value that had not changed, works out which writes caused the changes that were seen and
+proposes read backs after the writes that cause them. Periodic scans of values the device
+never changes, or whose reads are all repeated by a scan at least as fast, are dropped.
+Slower scans are only proposed with --background and reported as weakening freshness. The
+serial link time saved is estimated for one device.
+
+Capture a trace from the emulator, over either transport of the stream adapter:
+
+    lewis-control device start_command_trace
+    (exercise the IOC)
+    lewis-control device get_command_trace > trace.txt
+
+then run from the system_tests directory:
+
+    python -m tools.dg645_scan_optimiser trace.txt [--application LITRON] [--baud 9600]
+
+The tool's unit tests run from run_tests.bat, or on their own from the system_tests directory:
+
+    python -m unittest discover --pattern "test_*.py"
+"""
+
+import argparse
+import ast
+import re
+from collections import defaultdict
+from pathlib import Path
+
+DB_DIR = Path(__file__).resolve().parents[2] / "dg645Sup"
+
+CHANNELS = ("T0", "T1", "A", "B", "C", "D", "E", "F", "G", "H")
+OUTPUTS = ("AB", "CD", "EF", "GH")
+SCAN_PERIODS = (0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+# The device refuses writes to T0 and T1, so T0 never changes and T1 only follows A to H
+REFUSED_WRITES = ("DLAY 0", "DLAY 1")
+CONSTANT_READS = ("DLAY?0",)
+
+IN_TERMINATOR = "\n"
+OUT_TERMINATOR = "\r\n"
+
+# Databases and macros as loaded by the DG645 IOC, LITRON adds litron.db on top
+LAYOUTS = {
+    "DG645": [("dg645.db", {})]
+    + [("dg645_delay.db", {"Q": q}) for q in CHANNELS[2:]]
+    + [("dg645_width.db", {"Q": q}) for q in OUTPUTS]
+    + [("dg645_delay_width_shared.db", {"Q": q}) for q in CHANNELS[2:] + OUTPUTS]
+    + [("dg645_logic.db", {"Q": q}) for q in ("T0",) + OUTPUTS],
+}
+LAYOUTS["LITRON"] = LAYOUTS["DG645"] + [("litron.db", {})]
+
+RECORD = re.compile(r'record\(\s*(\w+)\s*,\s*"([^"]+)"\s*\)\s*\{(.*?)\}', re.S)
+FIELD = re.compile(r'field\(\s*(\w+)\s*,\s*"([^"]*)"\s*\)')
+MACRO = re.compile(r"\$\((\w+)(?:=([^)]*))?\)")
+ASYN_PARAM = re.compile(r"@asyn\([^)]*\)\s*(\w+)")
+PERIODIC_SCAN = re.compile(r"^\s*(\d*\.?\d+)\s+second")
+# Records provided by the delaygen module rather than dg645Sup, e.g. ADelayAI, CDelayAO
+DELAYGEN_RECORD = re.compile(r"^(T0|T1|[A-H])(DelayAI|ReferenceMI|DelayAO|ReferenceMO)$")
+INPUT_TYPES = ("ai", "bi", "mbbi", "longin", "stringin")
+FORWARD_TYPES = ("fanout", "seq", "sseq")
+
+
+class Record:
+    def __init__(self, record_type: str, name: str, fields: dict[str, str]) -> None:
+        self.type = record_type
+        self.name = name
+        self.fields = fields
+
+    def links(self) -> list[tuple[str, str, str]]:
+        # (field, target record, flags) for every field pointing at another record
+        links = []
+        for field, value in self.fields.items():
+            if field in ("DTYP", "DESC", "CALC", "SCAN") or value.startswith("@"):
+                continue
+            parts = value.split()
+            if parts and re.match(r"^[A-Za-z_][\w:]*(\.\w+)?$", parts[0]):
+                target, _, target_field = parts[0].partition(".")
+                flags = " ".join(parts[1:]) + (" PROC" if target_field == "PROC" else "")
+                links.append((field, target, flags))
+        return links
+
+    def forward_targets(self) -> list[str]:
+        # Records processed as a consequence of this record processing
+        targets = []
+        for field, target, flags in self.links():
+            if field == "FLNK" or (self.type in FORWARD_TYPES and field.startswith("LNK")):
+                targets.append(target)
+            elif field in ("OUT",) or field.startswith("LNK"):
+                if "PP" in flags.split() or "PROC" in flags.split():
+                    targets.append(target)
+        return targets
+
+
+def expand_macros(text: str, macros: dict[str, str]) -> str:
+    return MACRO.sub(lambda match: macros.get(match.group(1), match.group(2) or ""), text)
+
+
+def load_records(application: str, db_dir: Path = DB_DIR) -> dict[str, Record]:
+    records = {}
+    for filename, macros in LAYOUTS[application]:
+        text = (db_dir / filename).read_text()
+        text = "\n".join(line.split("#", 1)[0] for line in text.splitlines())
+        text = expand_macros(text, macros)
+        for record_type, name, body in RECORD.findall(text):
+            records[name] = Record(record_type, name, dict(FIELD.findall(body)))
+    return records
+
+
+def read_command(record_name: str, record: Record | None) -> str | None:
+    # The query the delaygen driver sends to the device when the record processes
+    if record is None:
+        match = DELAYGEN_RECORD.match(record_name)
+        if match and match.group(2) in ("DelayAI", "ReferenceMI"):
+            return "DLAY?{}".format(CHANNELS.index(match.group(1)))
+        return None
+    if record.type not in INPUT_TYPES or not record.fields.get("DTYP", "").startswith("asyn"):
+        return None
+    param = ASYN_PARAM.match(record.fields.get("INP", ""))
+    if param is not None:
+        channel, _, kind = param.group(1).partition("_")
+        if channel in CHANNELS and kind in ("DELAY", "REF"):
+            return "DLAY?{}".format(CHANNELS.index(channel))
+    return None
+
+
+def write_command(record_name: str, record: Record | None) -> str | None:
+    # The command family ("DLAY 2") a record writes to the device when it processes
+    if record is None:
+        match = DELAYGEN_RECORD.match(record_name)
+        if match and match.group(2) in ("DelayAO", "ReferenceMO"):
+            return "DLAY {}".format(CHANNELS.index(match.group(1)))
+        return None
+    param = ASYN_PARAM.match(record.fields.get("OUT", ""))
+    if param is not None:
+        channel, _, kind = param.group(1).partition("_")
+        if channel in CHANNELS and kind in ("DELAY", "REF"):
+            return "DLAY {}".format(CHANNELS.index(channel))
+    return None
+
+
+class RecordGraph:
+    def __init__(self, records: dict[str, Record]) -> None:
+        self.records = records
+        self.names = set(records)
+        self.forward = defaultdict(set)
+        self.cp_consumers = defaultdict(set)
+        for record in records.values():
+            for target in record.forward_targets():
+                self.forward[record.name].add(target)
+                self.names.add(target)
+            for field, target, flags in record.links():
+                if field.startswith("INP") and "CP" in flags.split():
+                    self.cp_consumers[target].add(record.name)
+                    self.names.add(target)
+
+    def scan_rates(self) -> dict[str, list[tuple[str, float]]]:
+        # For every record, the periodic records that cause it to process and their period
+        rates = defaultdict(list)
+        for record in self.records.values():
+            period = PERIODIC_SCAN.match(record.fields.get("SCAN", ""))
+            if period is None:
+                continue
+            seen, pending = set(), [record.name]
+            while pending:
+                name = pending.pop()
+                if name in seen:
+                    continue
+                seen.add(name)
+                rates[name].append((record.name, float(period.group(1))))
+                pending.extend(self.forward[name])
+        return rates
+
+    def downstream(self, name: str) -> set[str]:
+        # Records reprocessed through CP links and forward links when name posts a new value
+        seen, pending = set(), list(self.cp_consumers[name])
+        while pending:
+            current = pending.pop()
+            if current not in seen:
+                seen.add(current)
+                pending.extend(self.cp_consumers[current] | self.forward[current])
+        return seen
+
+    def readers(self) -> dict[str, list[str]]:
+        readers = defaultdict(list)
+        for name in sorted(self.names):
+            command = read_command(name, self.records.get(name))
+            if command is not None:
+                readers[command].append(name)
+        return readers
+
+    def writers(self) -> dict[str, list[str]]:
+        writers = defaultdict(list)
+        for name in sorted(self.names):
+            command = write_command(name, self.records.get(name))
+            if command is not None:
+                writers[command].append(name)
+        return writers
+
+
+def load_trace(path: Path) -> list[tuple[float, str, str, str]]:
+    # One entry per command, lines holding several commands are split at their semicolons
+    # and their replies handed out to the queries in order
+    commands = []
+    for timestamp, client, request, reply in ast.literal_eval(path.read_text()):
+        replies = iter([] if reply is None else reply.split(OUT_TERMINATOR))
+        for command in request.split(";"):
+            command = " ".join(command.strip().upper().split())
+            if command:
+                commands.append(
+                    (timestamp, client, command, next(replies, None) if "?" in command else None)
+                )
+    return commands
+
+
+def write_family(command: str) -> str:
+    mnemonic, _, arguments = command.partition(" ")
+    return "{} {}".format(mnemonic, arguments.split(",")[0].strip())
+
+
+class ReadStats:
+    def __init__(self) -> None:
+        self.reads = 0
+        self.redundant = 0
+        self.changes = {"ioc": 0, "other": 0, "unexplained": 0}
+        self.causes = set()
+        self.bytes = 0
+
+
+def analyse_trace(
+    trace: list[tuple[float, str, str, str]], ioc: str
+) -> tuple[dict[str, ReadStats], dict[str, int], float]:
+    stats = defaultdict(ReadStats)
+    last_reply = {}
+    writes_since = defaultdict(list)
+    ioc_writes = defaultdict(int)
+    for _, client, command, reply in trace:
+        if "?" not in command:
+            family = write_family(command)
+            if client == ioc:
+                ioc_writes[family] += 1
+            for pending in writes_since.values():
+                pending.append((client, family))
+            continue
+
+        # The IOC's polling is what gets rescheduled, other clients' reads only track changes
+        if client == ioc:
+            read = stats[command]
+            read.reads += 1
+            read.bytes += len(command) + len(IN_TERMINATOR) + len(reply or "")
+            read.bytes += len(OUT_TERMINATOR)
+            if last_reply.get(command) == reply:
+                read.redundant += 1
+
+        if command in last_reply and last_reply[command] != reply:
+            # Blame writes to the same channel if there were any, otherwise the value is
+            # derived (like T1) and any of the writes in between may have changed it
+            writers = writes_since[command]
+            same_channel = write_family(command.replace("?", " "))
+            writers = [write for write in writers if write[1] == same_channel] or writers
+            if not writers:
+                stats[command].changes["unexplained"] += 1
+            elif any(writer != ioc for writer, _ in writers):
+                stats[command].changes["other"] += 1
+            else:
+                stats[command].changes["ioc"] += 1
+                stats[command].causes.update(family for _, family in writers)
+        last_reply[command] = reply
+        writes_since[command] = []
+
+    duration = trace[-1][0] - trace[0][0] if len(trace) > 1 else 0.0
+    return stats, ioc_writes, duration
+
+
+def busiest_reader(trace: list[tuple[float, str, str, str]]) -> str:
+    counts = defaultdict(int)
+    for _, client, command, _ in trace:
+        if "?" in command:
+            counts[client] += 1
+    return max(counts, key=counts.get)
+
+
+def read_back_causes(command: str, read: ReadStats) -> list[str]:
+    # Writes after which the IOC should read the value back, whether or not the trace saw them.
+    # T1 follows the longest of the other delays, so a write to any of them can change it
+    if command in CONSTANT_READS:
+        return []
+    if command == "DLAY?1":
+        own = ["DLAY {}".format(channel) for channel in range(2, len(CHANNELS))]
+    else:
+        own = [write_family(command.replace("?", " "))]
+    return sorted(cause for cause in read.causes | set(own) if cause not in REFUSED_WRITES)
+
+
+def constant_readers(graph: RecordGraph, readers: dict[str, list[str]]) -> set[str]:
+    # Readers of values the device never changes, which only need reading once at startup
+    return {
+        reader
+        for command in CONSTANT_READS
+        for reader in readers.get(command, [])
+        if reader in graph.records and graph.records[reader].fields.get("PINI") == "YES"
+    }
+
+
+def plan_scans(
+    rates: dict[str, list[tuple[str, float]]],
+    device_readers: set[str],
+    changed_outside: set[str],
+    background: float | None,
+    constant: set[str] = frozenset(),
+) -> dict[str, tuple[float, float | None]]:
+    """
+    Returns (current period, new period) for every periodic record that causes a device read,
+    the new period is None where the record can be made passive.
+
+    Sources are taken fastest first. A source whose readers all read constant values, or are
+    all already processed by a source at least as fast, adds no freshness and is dropped, the
+    others keep their period. Only with a background period are sources slowed down, and only
+    if none of their readers saw changes from outside the IOC.
+    """
+    sources = defaultdict(set)
+    periods = {}
+    for reader in device_readers:
+        for source, period in rates.get(reader, []):
+            sources[source].add(reader)
+            periods[source] = period
+
+    plan = {}
+    covered = set(constant)
+    for source in sorted(sources, key=lambda name: (periods[name], name)):
+        period = periods[source]
+        if sources[source] <= covered:
+            plan[source] = (period, None)
+            continue
+        covered |= sources[source]
+        if background is not None and not sources[source] & changed_outside:
+            plan[source] = (period, max(period, background))
+        else:
+            plan[source] = (period, period)
+    return plan
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", type=Path, help="Output of get_command_trace")
+    parser.add_argument("--application", choices=sorted(LAYOUTS), default="DG645")
+    parser.add_argument("--ioc", help="Trace client name of the IOC, default busiest reader")
+    parser.add_argument("--baud", type=int, default=9600, help="Serial link baud rate")
+    parser.add_argument("--bits-per-char", type=int, default=10, help="8N1 is 10 bits")
+    parser.add_argument(
+        "--background",
+        type=float,
+        help="Also slow scans down to this period, in seconds, where the trace saw no changes "
+        "from outside the IOC. Such changes are then seen later than today",
+    )
+    args = parser.parse_args()
+
+    graph = RecordGraph(load_records(args.application))
+    rates = graph.scan_rates()
+    readers = graph.readers()
+    writers = graph.writers()
+
+    trace = load_trace(args.trace)
+    if not any("?" in command for _, _, command, _ in trace):
+        raise SystemExit("Trace holds no queries, capture one while the IOC is polling")
+    ioc = args.ioc or busiest_reader(trace)
+    stats, ioc_writes, duration = analyse_trace(trace, ioc)
+    if duration <= 0:
+        raise SystemExit("Trace must span some time")
+
+    changed_outside = {
+        reader
+        for command, names in readers.items()
+        if stats[command].changes["other"] or stats[command].changes["unexplained"]
+        for reader in names
+    }
+    device_readers = {reader for names in readers.values() for reader in names}
+    constant = constant_readers(graph, readers)
+    plan = plan_scans(rates, device_readers, changed_outside, args.background, constant)
+
+    def seconds_per_read(command: str) -> float:
+        read = stats[command]
+        chars = read.bytes / read.reads if read.reads else len(command) + 20
+        return chars * args.bits_per_char / args.baud
+
+    print("Application {}, trace {:.1f} s, IOC client {}".format(args.application, duration, ioc))
+    print()
+    header = "{:<8}{:>10}{:>10}{:>11}{:>16}{:>10}{:>12}  {}"
+    row = "{:<8}{:>10.2f}{:>10.2f}{:>10.0f}%{:>16}{:>10.2f}{:>12.2f}  {}"
+    print(
+        header.format(
+            "command",
+            "db/s",
+            "seen/s",
+            "redundant",
+            "ioc/other/unex",
+            "new/s",
+            "saved ms/s",
+            "proposal",
+        )
+    )
+
+    triggers = {}
+    weakened = []
+    current_total = proposed_total = 0.0
+    for command in sorted(set(readers) | set(stats), key=lambda c: (len(c), c)):
+        periodic = [
+            (reader, source)
+            for reader in readers.get(command, [])
+            for source, _ in rates.get(reader, [])
+        ]
+        read = stats[command]
+        if not periodic and not read.reads:
+            continue
+
+        db_rate = sum(1 / plan[source][0] for _, source in periodic)
+        new_db_rate = sum(1 / plan[source][1] for _, source in periodic if plan[source][1])
+        seen_rate = read.reads / duration
+        current = seen_rate if read.reads else db_rate
+        redundant = 100 * read.redundant / read.reads if read.reads else 0.0
+
+        fastest = min((plan[source][0] for _, source in periodic), default=None)
+        slowest_kept = max((plan[source][1] or 0 for _, source in periodic), default=0)
+        if new_db_rate >= db_rate:
+            # Polled as today, reads on demand are already part of what the trace saw
+            proposed = current
+            proposal = "unchanged" if fastest is None else "unchanged, {:g} s".format(fastest)
+        else:
+            # Polling scaled like the database, plus one read back after each IOC write
+            causes = read_back_causes(command, read)
+            proposed = current * new_db_rate / db_rate
+            proposed += sum(ioc_writes[cause] for cause in causes) / duration
+            for reader in readers.get(command, []):
+                triggers[reader] = [name for cause in causes for name in writers.get(cause, [])]
+            if not causes:
+                proposal = "once at startup"
+            elif not slowest_kept:
+                proposal = "after {}".format(", ".join(causes))
+            else:
+                proposal = "after {}, else {:g} s (was {:g} s)".format(
+                    ", ".join(causes), slowest_kept, fastest
+                )
+                weakened.append((command, fastest, slowest_kept))
+
+        saved = (current - proposed) * seconds_per_read(command) * 1000
+        current_total += current * seconds_per_read(command) * 1000
+        proposed_total += proposed * seconds_per_read(command) * 1000
+        changes = "{ioc}/{other}/{unexplained}".format(**read.changes)
+        print(
+            row.format(command, db_rate, seen_rate, redundant, changes, proposed, saved, proposal)
+        )
+
+    print()
+    print("Proposed scan layout:")
+    for source, (period, new_period) in sorted(plan.items()):
+        if new_period is None and source in constant:
+            print(
+                '  {}: SCAN "{:g} second" -> "Passive", the device never changes it and '
+                "PINI still reads it at startup".format(source, period)
+            )
+        elif new_period is None:
+            print(
+                '  {}: SCAN "{:g} second" -> "Passive", its reads are covered by faster '
+                "scans".format(source, period)
+            )
+        elif new_period != period:
+            print('  {}: SCAN "{:g} second" -> "{:g} second"'.format(source, period, new_period))
+    for reader, names in sorted(triggers.items()):
+        if names:
+            print("  process {} after writes from {}".format(reader, ", ".join(names)))
+            consumers = graph.downstream(reader)
+            if consumers:
+                print("      CP consumers kept up to date: {}".format(len(consumers)))
+
+    print()
+    if weakened:
+        print("WEAKER FRESHNESS: changes made outside the IOC are seen later than today for")
+        for command, period, new_period in weakened:
+            print("  {}: within {:g} s instead of {:g} s".format(command, new_period, period))
+    else:
+        print(
+            "Freshness unchanged: every value the device can change is still polled at its "
+            "fastest current\nperiod, and IOC writes to values polled less are read back "
+            "straight away."
+        )
+
+    print()
+    print(
+        "Serial link time per device at {} baud: {:.2f} ms/s now, {:.2f} ms/s proposed, "
+        "{:.2f} ms/s saved".format(
+            args.baud, current_total, proposed_total, current_total - proposed_total
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
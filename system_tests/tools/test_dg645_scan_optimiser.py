@@ -0,0 +1,133 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from tools.dg645_scan_optimiser import (
+    ReadStats,
+    RecordGraph,
+    analyse_trace,
+    constant_readers,
+    load_records,
+    load_trace,
+    main,
+    plan_scans,
+    read_back_causes,
+    read_command,
+    write_command,
+)
+
+
+class ScanOptimiserTests(unittest.TestCase):
+    def trace_file(self, entries: list[tuple[float, str, str, str | None]]) -> Path:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "trace.txt"
+        path.write_text(repr(entries))
+        return path
+
+    def test_WHEN_line_holds_several_commands_THEN_replies_handed_to_queries_in_order(self):
+        trace = load_trace(
+            self.trace_file([(1.0, "gui", "LOCK?;dlay  2,0,1e-6;DLAY?2;UNLK?", "1\r\n0,1e-6\r\n1")])
+        )
+        self.assertEqual(
+            trace,
+            [
+                (1.0, "gui", "LOCK?", "1"),
+                (1.0, "gui", "DLAY 2,0,1E-6", None),
+                (1.0, "gui", "DLAY?2", "0,1e-6"),
+                (1.0, "gui", "UNLK?", "1"),
+            ],
+        )
+
+    def test_WHEN_value_changes_THEN_change_blamed_on_writer_of_same_channel(self):
+        trace = [
+            (0.0, "ioc", "DLAY?2", "0,0"),
+            (0.0, "ioc", "DLAY?2", "0,0"),
+            (0.5, "ioc", "DLAY 2,0,1E-6", None),
+            (0.5, "script", "DLAY 3,0,1E-6", None),
+            (1.0, "ioc", "DLAY?2", "0,1e-6"),
+            (1.5, "script", "DLAY 2,0,2E-6", None),
+            (2.0, "ioc", "DLAY?2", "0,2e-6"),
+            (3.0, "ioc", "DLAY?2", "0,3e-6"),
+        ]
+        stats, ioc_writes, duration = analyse_trace(trace, "ioc")
+
+        read = stats["DLAY?2"]
+        self.assertEqual(read.reads, 5)
+        self.assertEqual(read.redundant, 1)
+        self.assertEqual(read.changes, {"ioc": 1, "other": 1, "unexplained": 1})
+        self.assertEqual(read.causes, {"DLAY 2"})
+        self.assertEqual(ioc_writes, {"DLAY 2": 1})
+        self.assertEqual(duration, 3.0)
+
+    def test_WHEN_derived_value_changes_THEN_change_blamed_on_any_write_in_between(self):
+        trace = [
+            (0.0, "ioc", "DLAY?1", "0,0"),
+            (0.5, "ioc", "DLAY 5,0,1E-6", None),
+            (1.0, "ioc", "DLAY?1", "0,1e-6"),
+        ]
+        stats, _, _ = analyse_trace(trace, "ioc")
+
+        self.assertEqual(stats["DLAY?1"].changes["ioc"], 1)
+        self.assertEqual(stats["DLAY?1"].causes, {"DLAY 5"})
+
+    def test_WHEN_T1_read_THEN_read_back_after_writes_to_every_writable_channel(self):
+        read = ReadStats()
+        read.causes = {"DLAY 1", "DLAY 3"}
+        causes = read_back_causes("DLAY?1", read)
+        self.assertEqual(causes, ["DLAY {}".format(channel) for channel in range(2, 10)])
+        self.assertEqual(read_back_causes("DLAY?4", ReadStats()), ["DLAY 4"])
+
+    def test_WHEN_T0_read_THEN_no_read_back_as_device_refuses_writes_to_it(self):
+        read = ReadStats()
+        read.causes = {"DLAY 0"}
+        self.assertEqual(read_back_causes("DLAY?0", read), [])
+
+    def test_WHEN_no_background_THEN_only_scans_repeating_faster_ones_are_dropped(self):
+        rates = {
+            "ADelayAI": [("ADelayAI:ForceScan", 0.2), ("ADelayAI", 1.0)],
+            "CDelayAI": [("CDelayAI", 1.0)],
+        }
+        plan = plan_scans(rates, {"ADelayAI", "CDelayAI"}, set(), None)
+        self.assertEqual(
+            plan,
+            {
+                "ADelayAI:ForceScan": (0.2, 0.2),
+                "ADelayAI": (1.0, None),
+                "CDelayAI": (1.0, 1.0),
+            },
+        )
+
+    def test_WHEN_background_given_THEN_only_scans_without_outside_changes_slowed(self):
+        rates = {"ADelayAI": [("ADelayAI", 0.2)], "CDelayAI": [("CDelayAI", 0.2)]}
+        plan = plan_scans(rates, {"ADelayAI", "CDelayAI"}, {"CDelayAI"}, 10.0)
+        self.assertEqual(plan, {"ADelayAI": (0.2, 10.0), "CDelayAI": (0.2, 0.2)})
+
+    def test_WHEN_dg645_databases_loaded_THEN_only_constant_T0_scan_made_passive(self):
+        graph = RecordGraph(load_records("DG645"))
+        readers = graph.readers()
+        constant = constant_readers(graph, readers)
+        device_readers = {reader for names in readers.values() for reader in names}
+
+        plan = plan_scans(graph.scan_rates(), device_readers, set(), None, constant)
+
+        self.assertEqual(constant, {"T0DelayAI", "T0ReferenceMI"})
+        self.assertEqual(plan, {"T0DelayAI": (1.0, None), "T1DelayAI": (1.0, 1.0)})
+
+    def test_WHEN_trace_holds_no_queries_THEN_tool_exits_with_message(self):
+        for entries in ([], [(0.0, "ioc", "DLAY 2,0,1e-6", None)]):
+            argv = ["dg645_scan_optimiser", str(self.trace_file(entries)), "--ioc", "ioc"]
+            with mock.patch("sys.argv", argv), self.assertRaises(SystemExit) as exit:
+                main()
+            self.assertIn("no queries", str(exit.exception.code))
+
+    def test_WHEN_litron_databases_loaded_THEN_force_scans_drive_delaygen_readers(self):
+        graph = RecordGraph(load_records("LITRON"))
+        rates = graph.scan_rates()
+
+        self.assertIn(("ADelayAI:ForceScan", 0.2), rates["ADelayAI"])
+        self.assertIn("ADelayAI", graph.readers()["DLAY?2"])
+        self.assertIn("CDelayAO", graph.writers()["DLAY 4"])
+        self.assertEqual(read_command("T1DelayAI", None), "DLAY?1")
+        self.assertEqual(write_command("HReferenceMO", None), "DLAY 9")